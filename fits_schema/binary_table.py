@@ -4,22 +4,24 @@ Schema definitions for FITS binary table extensions
 See section 7.3 of the FITS standard:
 https://fits.gsfc.nasa.gov/standard40/fits_standard40aa-le.pdf
 '''
-from abc import ABCMeta, abstractmethod
+import weakref
+from functools import lru_cache
 import numpy as np
-import astropy.units as u
 from astropy.io import fits
-from astropy.table import Table
 import logging
 
 from .header import HeaderSchema, HeaderCard, HeaderSchemaMeta
 from .exceptions import (
     WrongUnit, WrongDims, WrongType, RequiredMissing, WrongShape,
 )
-from .utils import log_or_raise
+from .utils import log_or_raise, ErrorCollector
 
 
 log = logging.getLogger(__name__)
 
+#: maximum number of valid headers remembered per table schema
+HEADER_CACHE_SIZE = 128
+
 
 class BinaryTableHeader(HeaderSchema):
     '''default binary table header schema'''
@@ -34,7 +36,7 @@ class BinaryTableHeader(HeaderSchema):
     EXTNAME = HeaderCard(required=False, type_=str)
 
 
-class Column(metaclass=ABCMeta):
+class Column:
     '''
     A column descriptor for columns consisting of a primitive data type
     or fixed shape array.
@@ -55,6 +57,23 @@ class Column(metaclass=ABCMeta):
     shape: Tuple[int]
         Shape of a single row.
     '''
+    __slots__ = (
+        'required', '_unit', 'strict_unit', 'name', 'shape', 'ndim',
+        '_validated_cache', '_validator',
+    )
+
+    #: FITS TFORM code of the column type, defined by subclasses
+    tform_code = None
+    #: Equivalent numpy dtype, defined by subclasses
+    dtype = None
+    _np_dtype = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # normalize the dtype once per column type instead of on every validation
+        if cls.__dict__.get('dtype') is not None:
+            cls._np_dtype = np.dtype(cls.dtype)
+
     def __init__(
         self, *,
         unit=None,
@@ -64,6 +83,10 @@ class Column(metaclass=ABCMeta):
         ndim=None,
         shape=None,
     ):
+        # weak references to already validated arrays, see `validate_data`
+        self._validated_cache = {}
+        self._validator = None
+
         self.required = required
         self.unit = unit
         self.strict_unit = strict_unit
@@ -83,91 +106,296 @@ class Column(metaclass=ABCMeta):
             if self.ndim is None:
                 self.ndim = 0
 
+    @property
+    def unit(self):
+        return self._unit
+
+    @unit.setter
+    def unit(self, unit):
+        # parse strings once here, validation compares against the unit object
+        if unit is not None:
+            unit = _parse_unit(unit)
+        self._unit = unit
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        # validation depends on the settings of the column,
+        # reset the compiled validator and the validated data if they change
+        if name not in ('_validated_cache', '_validator'):
+            super().__setattr__('_validator', None)
+            # subclasses might set attributes before calling `__init__`
+            cache = getattr(self, '_validated_cache', None)
+            if cache is not None:
+                cache.clear()
+
+    def __getstate__(self):
+        # the compiled validator is a closure and cannot be pickled,
+        # both it and the cache are rebuilt when needed
+        state = {
+            k: getattr(self, k) for k in Column.__slots__
+            if k not in ('_validated_cache', '_validator')
+        }
+        # attributes of subclasses without slots
+        state.update(getattr(self, '__dict__', {}))
+        return state
+
+    def __setstate__(self, state):
+        self._validated_cache = {}
+        self._validator = None
+        for k, v in state.items():
+            setattr(self, k, v)
+
     def __get__(self, instance, owner=None):
         # class attribute access
         if instance is None:
             return self
 
-        return instance.__data__.get(self.name)
+        return getattr(instance.__data__, self.name, None)
 
     def __set__(self, instance, value):
-        instance.__data__[self.name] = value
+        setattr(instance.__data__, self.name, value)
 
     def __set_name__(self, owner, name):
         # respect user override for names that are not valid identifiers
         if self.name is None:
             self.name = name
 
+        # register with the table schema this column is defined in
+        if isinstance(owner, BinaryTableMeta):
+            owner.__columns__[self.name] = self
+
     def __delete__(self, instance):
         '''clear data of this column'''
-        if self.name in instance.__data__:
-            del instance.__data__[self.name]
+        try:
+            delattr(instance.__data__, self.name)
+        except AttributeError:
+            pass
 
     def __repr__(self):
-        unit = f'\'{self.unit.to_string("fits")}\'' if self.unit is not None else None
+        unit = f'\'{_unit_string(self.unit)}\'' if self.unit is not None else None
         return (
             f'{self.__class__.__name__}('
             f"name={self.name!r}, required={self.required}, unit={unit}"
             ')'
         )
 
-    @property
-    @abstractmethod
-    def dtype():
-        '''Equivalent numpy dtype'''
-
     def validate_data(self, data, onerror='raise'):
-        ''' Validate the data of this column in table '''
-        if data is None:
-            if self.required:
+        '''
+        Validate the data of this column in table
+
+        ``onerror`` is either "raise", "log" or an error handler
+        as returned by `~fits_schema.utils.get_error_handler`.
+        '''
+        if onerror == 'collect':
+            raise ValueError(
+                'Pass an `ErrorCollector` instance to collect errors of a single column'
+            )
+
+        # re-validating the very same array is common, e.g. calling
+        # `BinaryTable.validate_data` repeatedly, so we keep track of
+        # arrays that already passed validation.
+        key = _cache_key(data)
+        cache = self._validated_cache
+        if key is not None:
+            ref = cache.get(key)
+            if ref is not None and ref() is data:
+                return data
+
+        validator = self._validator
+        if validator is None:
+            validator = self._validator = self._compile_validator()
+
+        q = validator(data, onerror)
+
+        # only cache data that passed all checks.
+        # A converted result is remembered for itself, not for ``data``,
+        # as it would not see later changes of ``data``
+        if q is not None and onerror == 'raise':
+            if q is not data:
+                key = _cache_key(q)
+            if key is not None and key not in cache:
+                self._cache_validated(key, q)
+
+        return q
+
+    def _compile_validator(self):
+        '''
+        Build a validation function specialized to the current settings of this column.
+
+        All settings are bound as locals of the returned closure,
+        so validating does not need to look up any attributes of the column.
+        '''
+        # imported here as it is only needed for validation, not to define schemas
+        import astropy.units as u
+
+        if self._np_dtype is None:
+            raise NotImplementedError(
+                f'{self.__class__.__name__} does not define a dtype'
+            )
+
+        name = self.name
+        required = self.required
+        unit = self.unit
+        strict_unit = self.strict_unit
+        dtype = self._np_dtype
+        ndim = self.ndim
+        ndim_col = ndim + 1
+        shape = self.shape
+
+        def validate(data, onerror):
+            if data is None:
+                if required:
+                    log_or_raise(
+                        f'Column {name} is required but missing',
+                        RequiredMissing, log=log, onerror=onerror
+                    )
+                return None
+
+            # let's test first for the datatype,
+            # the actual conversion is done once when creating the quantity below.
+            # casting = 'safe' makes sure we don't change values
+            # e.g. casting doubles to integers will no longer work
+            if not isinstance(data, np.ndarray):
+                try:
+                    data = np.asanyarray(data)
+                except (TypeError, ValueError) as e:
+                    log_or_raise(
+                        f'Data of column {name} is not convertible to an array: {e}',
+                        WrongType, log=log, onerror=onerror,
+                    )
+                    return None
+
+            # arrays that already have the column dtype need neither check nor cast.
+            # min_scalar_type takes the value of scalars into account,
+            # e.g. 1 fits into an int16 but 2**15 does not, for arrays it is the dtype
+            castable = data.dtype == dtype
+            if not castable:
+                castable = np.can_cast(np.min_scalar_type(data), dtype, casting='safe')
+            if not castable:
                 log_or_raise(
-                    f'Column {self.name} is required but missing',
-                    RequiredMissing, log=log, onerror=onerror
+                    f'dtype {data.dtype} not convertible to column dtype {dtype}',
+                    WrongType, log=log, onerror=onerror
                 )
+
+            if strict_unit and hasattr(data, 'unit'):
+                # identity check avoids the expensive unit comparison in most cases
+                if data.unit is not unit and data.unit != unit:
+                    log_or_raise(
+                        f'Unit {data.unit} of data does not match specified unit {unit}',
+                        WrongUnit, log=log, onerror=onerror,
+                    )
+
+            # a table as one dimension more than it's rows,
+            # we also allow a single scalar value for scalar rows
+            data_ndim = data.ndim
+            if data_ndim != ndim_col and not (data_ndim == 0 and ndim == 0):
+                log_or_raise(
+                    f'Dimensionality of rows is {data_ndim - 1}, should be {ndim}',
+                    WrongDims, log=log, onerror=onerror,
+                )
+
+            # data of the wrong type cannot be converted for the remaining checks
+            if not castable:
+                return None
+
+            # the rest of the tests is done on an array with correct dtype,
+            # columns without unit need no quantity unless the data has a unit,
+            # e.g. quantities or table columns, which is kept
+            if unit is None and getattr(data, 'unit', None) is None:
+                # returns data itself for plain arrays already matching the column
+                q = np.asarray(data, dtype=dtype)
+                if data_ndim < ndim_col:
+                    q = q.reshape((1, ) * (ndim_col - data_ndim) + q.shape)
             else:
-                return
+                try:
+                    q = _quantity_no_copy(data, unit, dtype, ndim_col)
+                except u.UnitConversionError as e:
+                    log_or_raise(str(e), WrongUnit, log=log, onerror=onerror)
+                    return None
 
-        # let's test first for the datatype
-        try:
-            # casting = 'safe' makes sure we don't change values
-            # e.g. casting doubles to integers will no longer work
-            data = np.asanyarray(data).astype(self.dtype, casting='safe')
-        except TypeError as e:
-            log_or_raise(
-                f'dtype not convertible to column dtype: {e}',
-                WrongType, log=log, onerror=onerror
-            )
+            if shape is not None and q.shape[1:] != shape:
+                log_or_raise(
+                    f'Shape {q.shape[1:]} does not match required shape {shape}',
+                    WrongShape, log=log, onerror=onerror,
+                )
 
-        if self.strict_unit and hasattr(data, 'unit') and data.unit != self.unit:
-            log_or_raise(
-                f'Unit {data.unit} of data does not match specified unit {self.unit}',
-                WrongUnit, log=log, onerror=onerror,
-            )
+            return q
 
-        # a table as one dimension more than it's rows,
-        # we also allow a single scalar value for scalar rows
-        if data.ndim != self.ndim + 1 and not (data.ndim == 0 and self.ndim == 0):
-            log_or_raise(
-                f'Dimensionality of rows is {data.ndim - 1}, should be {self.ndim}',
-                WrongDims, log=log, onerror=onerror,
-            )
+        return validate
+
+    def _cache_validated(self, key, data):
+        '''Remember that ``data`` passed validation unchanged.
 
-        # the rest of the tests is done on a quantity object with correct dtype
+        Only a weak reference to ``data`` is kept and the entry
+        is dropped once ``data`` is garbage collected.
+        '''
         try:
-            q = u.Quantity(
-                data, self.unit, copy=False, ndmin=self.ndim + 1, dtype=self.dtype
-            )
-        except u.UnitConversionError as e:
-            log_or_raise(str(e), WrongUnit, log=log, onerror=onerror)
+            ref = weakref.ref(data)
+        except TypeError:
+            # objects like lists do not support weak references
+            return
+        weakref.finalize(data, self._validated_cache.pop, key, None)
+        self._validated_cache[key] = ref
 
-        shape = q.shape[1:]
-        if self.shape is not None and self.shape != shape:
-            log_or_raise(
-                f'Shape {shape} does not match required shape {self.shape}',
-                WrongShape, log=log, onerror=onerror,
-            )
 
-        return q
+def _cache_key(data):
+    '''
+    Key of ``data`` in the validation cache of a column.
+
+    dtype, shape and unit can change in place, so they are part of the key.
+    Returns None for data that cannot be cached,
+    e.g. with an unhashable `~astropy.units.UnrecognizedUnit`.
+    '''
+    key = (
+        id(data),
+        getattr(data, 'dtype', None),
+        getattr(data, 'shape', None),
+        getattr(data, 'unit', None),
+    )
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _quantity_no_copy(data, unit, dtype, ndmin):
+    '''
+    Convert data to a quantity with given unit, dtype and minimal dimensionality.
+
+    Quantities already fulfilling all requirements are returned as is,
+    otherwise a new quantity is created, copying the data only if needed.
+    Subclasses of `~astropy.units.Quantity` are kept instead of viewed as a new
+    plain quantity.
+    '''
+    import astropy.units as u
+
+    if isinstance(data, u.Quantity) and data.dtype == dtype and data.ndim >= ndmin:
+        if unit is None or data.unit is unit or data.unit == unit:
+            return data
+
+    return u.Quantity(data, unit, copy=False, subok=True, ndmin=ndmin, dtype=dtype)
+
+
+@lru_cache(maxsize=1024)
+def _parse_unit(unit):
+    '''Parse ``unit`` into an `~astropy.units.UnitBase`, shared by all columns'''
+    import astropy.units as u
+    return u.Unit(unit)
+
+
+@lru_cache(maxsize=1024)
+def _unit_string(unit):
+    '''
+    FITS string representation of ``unit``.
+
+    Falls back to the generic format for units FITS cannot represent,
+    e.g. ``u.imperial.inch``.
+    '''
+    try:
+        return unit.to_string('fits')
+    except ValueError:
+        return unit.to_string()
 
 
 class BinaryTableMeta(type):
@@ -187,129 +415,263 @@ class BinaryTableMeta(type):
             HeaderSchemaMeta, name + 'Header', (BinaryTableHeader, ), {},
         )
 
-        # inherit header schema and  from bases
-        for base in reversed(bases):
-            if hasattr(base, '__header__'):
-                dct['__header__'].update(base.__header__)
+        # inherit header schema and columns from bases
+        if len(bases) == 1 and isinstance(bases[0], BinaryTableMeta):
+            # common case of single inheritance from another table,
+            # the base already holds the merged columns and header of its bases
+            base, = bases
+            dct['__header__'].update(base.__header__)
+            dct['__columns__'] = dict(base.__columns__)
+        else:
+            for base in reversed(bases):
+                if hasattr(base, '__header__'):
+                    dct['__header__'].update(base.__header__)
 
-            if issubclass(base, BinaryTable):
-                dct['__columns__'].update(base.__columns__)
+                if issubclass(base, BinaryTable):
+                    dct['__columns__'].update(base.__columns__)
 
         if header_schema is not None:
             # add user defined header last
             dct['__header__'].update(header_schema)
 
-        # collect columns of this new schema
-        for k, v in dct.items():
-            if isinstance(v, Column):
-                k = v.name or k
-                dct['__columns__'][k] = v
-
+        # columns of this new schema add themselves to `__columns__`
+        # in `Column.__set_name__`, which is called when creating the class
         new_cls = super().__new__(cls, name, bases, dct)
+        columns = new_cls.__columns__
+
+        # needed for every validation, so compute once
+        new_cls._required_names = frozenset(
+            k for k, c in columns.items() if c.required
+        )
+        new_cls._data_cls = _make_data_cls(name, columns)
+        # headers that passed validation, see `BinaryTable._validate_header`
+        new_cls._valid_headers = {}
+        new_cls._valid_headers_schema = None
         return new_cls
 
 
+def _make_data_cls(name, columns):
+    '''
+    Create the class holding the column data of instances of a table.
+
+    Each column gets a slot, only names not usable as slots, e.g. names that
+    are not valid identifiers, are stored in an instance ``__dict__``.
+    '''
+    slots = tuple(k for k in columns if k.isidentifier() and not k.startswith('__'))
+    if len(slots) < len(columns):
+        slots += ('__dict__', )
+    return type(name + 'Data', (), {'__slots__': slots})
+
+
 class BinaryTable(metaclass=BinaryTableMeta):
     '''
     Schema definition class for a binary table
     '''
 
     def __init__(self, **column_data):
-        self.__data__ = {}
+        self.__data__ = self._data_cls()
         self.header = fits.Header()
 
         for k, v in column_data.items():
             setattr(self, k, v)
 
+    def __getstate__(self):
+        # the data holder class is created per schema and cannot be pickled,
+        # store the values of all set columns as plain dict instead
+        data = self.__data__
+        columns = {}
+        for k in self.__columns__:
+            try:
+                columns[k] = getattr(data, k)
+            except AttributeError:
+                pass
+        return {'header': self.header, 'columns': columns}
+
+    def __setstate__(self, state):
+        self.__data__ = data = self._data_cls()
+        self.header = state['header']
+        for k, v in state['columns'].items():
+            setattr(data, k, v)
+
     def validate_data(self):
+        data = self.__data__
         for k, col in self.__columns__.items():
-            validated = col.validate_data(self.__data__.get(k))
+            validated = col.validate_data(getattr(data, k, None))
             if validated is not None:
-                setattr(self, k, validated)
+                # the column name is not necessarily the attribute name
+                setattr(data, k, validated)
 
     @classmethod
     def validate_hdu(cls, hdu: fits.BinTableHDU, onerror='raise'):
+        '''
+        Validate header and data of ``hdu`` against this schema.
+
+        ``onerror`` decides what happens with the problems found:
+        "raise" raises the first error, "log" logs all of them
+        and "collect" returns all of them as list of ``(exc_type, msg)`` tuples.
+        '''
+        import astropy.units as u
+
         if not isinstance(hdu, fits.BinTableHDU):
             raise TypeError('hdu is not a BinTableHDU')
 
-        cls.__header__.validate_header(hdu.header, onerror=onerror)
-        required = set(c.name for c in cls.__columns__.values() if c.required)
-        missing = required - set(c.name for c in hdu.columns)
+        collect = onerror == 'collect'
+        if collect:
+            # one collector for the problems of header and all columns
+            onerror = ErrorCollector()
+
+        cls._validate_header(hdu.header, onerror=onerror)
+
+        # names and units of all columns in one pass over the column definitions
+        columns = hdu.columns
+        fits_units = dict(zip(columns.names, columns.units))
+
+        missing = cls._required_names.difference(fits_units)
         if missing:
+            names = ', '.join(sorted(missing))
             log_or_raise(
-                f'The following required columns are missing {missing}',
+                f'The following required columns are missing: {names}',
                 RequiredMissing,
                 log=log,
                 onerror=onerror
             )
 
-        table = Table.read(hdu)
+        # only access the columns defined in the schema instead of
+        # reading the full table, these are views into the (memmapped) hdu data
+        data = hdu.data
         for k, col in cls.__columns__.items():
-            if k in table.columns:
-                col.validate_data(table[k], onerror=onerror)
+            if k not in fits_units:
+                continue
+
+            column_data = data[k]
+            fits_unit = fits_units[k]
+            # the unit of the data is only checked for columns with a unit,
+            # for all others the plain array is validated without creating a quantity.
+            # Non-numeric data cannot be a quantity, it fails the dtype check anyway
+            # columns without TUNIT have an empty unit string
+            has_unit = col.unit is not None or col.strict_unit
+            if fits_unit and has_unit and column_data.dtype.kind not in 'OSU':
+                # same unit handling as in astropy's Table.read
+                unit = u.Unit(fits_unit, format='fits', parse_strict='warn')
+                column_data = u.Quantity(
+                    column_data, unit, copy=False, dtype=column_data.dtype
+                )
+
+            col.validate_data(column_data, onerror=onerror)
+
+        if collect:
+            return onerror
+
+    @classmethod
+    def _validate_header(cls, header, onerror='raise'):
+        '''
+        Validate header against the header schema of this table.
+
+        Files often contain many HDUs with the same header, so with
+        ``onerror='raise'`` the content of headers that passed validation
+        is remembered together with the warnings they caused,
+        which are issued again for every validation of the same header.
+        '''
+        if onerror != 'raise':
+            cls.__header__.validate_header(header, onerror=onerror)
+            return
+
+        # updating the header schema replaces its compiled form,
+        # previous results are not valid anymore in that case
+        compiled = cls.__header__._compiled()
+        if cls._valid_headers_schema is not compiled:
+            cls._valid_headers = {}
+            cls._valid_headers_schema = compiled
+
+        key = header.tostring()
+        valid_headers = cls._valid_headers
+        problems = valid_headers.get(key)
+        if problems is None:
+            problems = ErrorCollector()
+            cls.__header__.validate_header(header, onerror=problems)
+            if all(issubclass(exc_type, UserWarning) for exc_type, _ in problems):
+                if len(valid_headers) >= HEADER_CACHE_SIZE:
+                    # drop the oldest entry
+                    del valid_headers[next(iter(valid_headers))]
+                valid_headers[key] = problems
+
+        # raises the first error or issues the warnings
+        for exc_type, msg in problems:
+            log_or_raise(msg, exc_type, log=log, onerror=onerror)
 
 
 class Bool(Column):
     '''A Boolean binary table column'''
+    __slots__ = ()
     tform_code = 'L'
     dtype = bool
 
 
 class BitField(Column):
     '''Bitfield binary table column'''
+    __slots__ = ()
     tform_code = 'X'
     dtype = bool
 
 
 class Byte(Column):
     '''Byte binary table column'''
+    __slots__ = ()
     tform_code = 'B'
     dtype = np.uint8
 
 
 class Int16(Column):
     '''16 Bit signed integer binary table column'''
+    __slots__ = ()
     tform_code = 'I'
     dtype = np.int16
 
 
 class Int32(Column):
     '''32 Bit signed integer binary table column'''
+    __slots__ = ()
     tform_code = 'J'
     dtype = np.int32
 
 
 class Int64(Column):
     '''64 Bit signed integer binary table column'''
+    __slots__ = ()
     tform_code = 'K'
     dtype = np.int64
 
 
 class Char(Column):
     '''Single byte character binary table column'''
+    __slots__ = ()
     tform_code = 'A'
     dtype = np.dtype('S1')
 
 
 class Float(Column):
     '''Single precision floating point binary table column'''
+    __slots__ = ()
     tform_code = 'E'
     dtype = np.float32
 
 
 class Double(Column):
-    '''Single precision floating point binary table column'''
+    '''Double precision floating point binary table column'''
+    __slots__ = ()
     tform_code = 'D'
     dtype = np.float64
 
 
 class ComplexFloat(Column):
     '''Single precision complex binary table column'''
+    __slots__ = ()
     tform_code = 'C'
     dtype = np.csingle
 
 
 class ComplexDouble(Column):
-    '''Single precision complex binary table column'''
+    '''Double precision complex binary table column'''
+    __slots__ = ()
     tform_code = 'M'
     dtype = np.cdouble
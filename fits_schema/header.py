@@ -10,11 +10,14 @@ from .exceptions import (
     WrongValue,
 )
 import re
+import sys
+from collections import namedtuple
 from collections.abc import Iterable
+from types import MappingProxyType
 from astropy.io import fits
 import logging
 
-from .utils import log_or_raise
+from .utils import get_error_handler
 
 
 log = logging.getLogger(__name__)
@@ -24,6 +27,44 @@ HEADER_ALLOWED_TYPES = (str, bool, int, float, complex, date, datetime)
 TABLE_KEYWORDS = {'TTYPE', 'TUNIT', 'TFORM', 'TSCAL', 'TZERO', 'TDISP', 'TDIM'}
 IGNORE = TABLE_KEYWORDS
 
+# exact types of nearly all header values, checked before falling back to isinstance
+_COMMON_HEADER_TYPES = frozenset({str, int, float, bool})
+
+# compiled once, these are used for every card definition / header card
+_KEYWORD_RE = re.compile(r'[A-Z0-9\-_]{1,8}\Z')
+_IGNORE_RE = re.compile(r'(?:' + '|'.join(IGNORE) + r')\d*\Z')
+_UNDEFINED_TYPE = type(fits.Undefined())
+
+
+# attributes of `HeaderCard` deciding which checks are run
+_CHECK_SETTINGS = frozenset({
+    'position', 'type', 'allowed_values', 'case_insensitive', 'empty',
+})
+
+
+# counts changes of `HeaderCard.required` after creation of a card,
+# compiled schemas built before a change are rebuilt, see `HeaderSchema._compiled`
+_required_changes = 0
+
+
+def _normalize_types(types):
+    '''
+    Turn an iterable of types into the fastest argument to ``isinstance``.
+
+    A single type is returned as is, ``isinstance`` is fastest for a bare class.
+    Multiple types are returned as tuple in a fixed order, bool first
+    and the rest sorted by name, so error messages do not depend on set ordering.
+    '''
+    types = set(types)
+    if len(types) == 1:
+        return types.pop()
+    return tuple(sorted(types, key=lambda t: (t is not bool, t.__name__)))
+
+
+def _is_allowed(value):
+    '''Check if ``value`` is an instance of one of ``HEADER_ALLOWED_TYPES``'''
+    return type(value) in _COMMON_HEADER_TYPES or isinstance(value, HEADER_ALLOWED_TYPES)
+
 
 class HeaderCard:
     '''
@@ -42,12 +83,18 @@ class HeaderCard:
         if not None, the card must be at this position in the header,
         starting with the first card at 0
     type: one or a tuple of the types in ``HEADER_ALLOWED_TYPES``
+        Stored as a single type or tuple of types as accepted by ``isinstance``
     empty: True, False or None
         If True, value must be empty, if False must not be empty,
         if None, no check if a value is present is performed
     case_insensitive: True
         match str values case insensitively
     '''
+    __slots__ = (
+        'keyword', 'required', 'position', 'empty', 'case_insensitive',
+        'type', 'allowed_values', '_checks',
+    )
+
     def __init__(
         self, keyword=None, *, required=True,
         allowed_values=None, position=None, type_=None,
@@ -65,110 +112,248 @@ class HeaderCard:
         vals = allowed_values
         if vals is not None:
             if not isinstance(vals, Iterable) or isinstance(vals, str):
-                vals = {vals}
-            else:
-                vals = set(vals)
+                vals = (vals, )
 
+            # build the set of allowed values in a single pass
             if self.case_insensitive:
-                vals = set(v.upper() if isinstance(v, str) else v for v in vals)
+                vals = frozenset(v.upper() if isinstance(v, str) else v for v in vals)
+            else:
+                vals = frozenset(vals)
 
-            if not all(isinstance(v, HEADER_ALLOWED_TYPES) for v in vals):
+            if not all(_is_allowed(v) for v in vals):
                 raise ValueError(f'Values must be instances of {HEADER_ALLOWED_TYPES}')
 
         self.type = type_
         if type_ is not None:
             if isinstance(type_, Iterable):
-                self.type = tuple(set(type_))
+                self.type = _normalize_types(type_)
 
             # check that value and type match if both supplied
             if vals is not None:
-                if any(not isinstance(v, type_) for v in vals):
+                if any(not isinstance(v, self.type) for v in vals):
                     raise TypeError(f'`values` must be of type `type_`({type_}) or None')
         else:
             # if only value is supplied, deduce type from value
             if vals is not None:
-                self.type = tuple(set(type(v) for v in vals))
+                self.type = _normalize_types(type(v) for v in vals)
 
         self.allowed_values = vals
+        self._checks = self._select_checks()
+
+    def __setattr__(self, name, value):
+        global _required_changes
+
+        super().__setattr__(name, value)
+        # the selected checks depend on the settings of the card,
+        # `_checks` only exists once `__init__` has set all of them
+        if not hasattr(self, '_checks'):
+            return
+
+        if name in _CHECK_SETTINGS:
+            self._checks = self._select_checks()
+        elif name == 'required':
+            # the required keywords are part of the compiled schemas
+            _required_changes += 1
+
+    def _select_checks(self):
+        '''The checks configured for this card, only these are run in `validate`'''
+        checks = []
+        if self.position is not None:
+            checks.append(HeaderCard._check_position)
+        if self.type is not None:
+            checks.append(HeaderCard._check_type)
+        if self.allowed_values is not None:
+            # case folding is only needed if there are strings to compare with
+            if self.case_insensitive and any(
+                isinstance(v, str) for v in self.allowed_values
+            ):
+                checks.append(HeaderCard._check_allowed_values_upper)
+            else:
+                checks.append(HeaderCard._check_allowed_values)
+        if self.empty is not None:
+            checks.append(HeaderCard._check_empty)
+        return checks
 
     def __set_name__(self, owner, name):
         if self.keyword is None:
-            if len(name) > 8:
-                raise ValueError('FITS header keywords must be 8 characters or shorter')
-
-            if not re.match(r'^[A-Z0-9\-_]{1,8}$', name):
+            if not _KEYWORD_RE.match(name):
+                if len(name) > 8:
+                    raise ValueError(
+                        'FITS header keywords must be 8 characters or shorter'
+                    )
                 raise ValueError(
                     'FITS header keywords must only contain'
                     ' ascii uppercase, digit, _ or -'
                 )
-            self.keyword = name
 
-    def validate(self, card, pos, onerror='raise'):
-        '''Validate an astropy.io.fits.card.Card'''
-        valid = True
-        k = self.keyword
+            # interned, so comparisons with other interned keywords are identity checks
+            self.keyword = sys.intern(name)
 
-        if self.position is not None and self.position != pos:
-            valid = False
-            msg = (
-                f'Expected card {k} at position {self.position}'
-                f' but found at {pos}'
+    def validate(self, card, pos, onerror='raise'):
+        '''Validate an astropy.io.fits.card.Card
+
+        ``onerror`` is either "raise", "log" or an error handler
+        as returned by `~fits_schema.utils.get_error_handler`.
+        '''
+        if onerror == 'collect':
+            raise ValueError(
+                'Pass an `ErrorCollector` instance to collect errors of a single card'
             )
-            log_or_raise(msg, WrongPosition, log, onerror=onerror)
 
-        if self.type is not None and not isinstance(card.value, self.type):
-            valid = False
-            msg = (
-                f'Header keyword {k} has wrong type {type(card.value)}'
-                f', expected one of {self.type}'
-            )
-            log_or_raise(msg, WrongType, log, onerror=onerror)
+        checks = self._checks
+        if not checks:
+            return True
 
-        if self.allowed_values is not None:
-            if self.case_insensitive and isinstance(card.value, str):
-                val = card.value.upper()
-            else:
-                val = card.value
-            if val not in self.allowed_values:
-                log_or_raise(
-                    f'Possible values for {k!r} are {self.allowed_values}'
-                    f', found {card.value!r}',
-                    WrongValue,
-                    log,
-                    onerror=onerror
-                )
+        handle = get_error_handler(onerror, log)
+        valid = True
+        for check in checks:
+            valid &= check(self, card, pos, handle)
+        return valid
 
-        has_value = not (card.value is None or isinstance(card.value, fits.Undefined))
+    def _check_position(self, card, pos, handle):
+        if self.position != pos:
+            handle(
+                f'Expected card {self.keyword} at position {self.position}'
+                f' but found at {pos}',
+                WrongPosition,
+            )
+            return False
+        return True
+
+    def _check_type(self, card, pos, handle):
+        if not isinstance(card.value, self.type):
+            handle(
+                f'Header keyword {self.keyword} has wrong type {type(card.value)}'
+                f', expected one of {self.type}',
+                WrongType,
+            )
+            return False
+        return True
+
+    def _check_allowed_values(self, card, pos, handle):
+        if card.value not in self.allowed_values:
+            self._report_not_allowed(card, handle)
+            return False
+        return True
+
+    def _check_allowed_values_upper(self, card, pos, handle):
+        val = card.value
+        if isinstance(val, str):
+            val = val.upper()
+
+        if val not in self.allowed_values:
+            self._report_not_allowed(card, handle)
+            return False
+        return True
+
+    def _report_not_allowed(self, card, handle):
+        handle(
+            f'Possible values for {self.keyword!r} are {self.allowed_values}'
+            f', found {card.value!r}',
+            WrongValue,
+        )
+
+    def _check_empty(self, card, pos, handle):
+        # parsing the value of a card is not free, only do it once
+        value = card.value
+        has_value = not (value is None or value.__class__ is _UNDEFINED_TYPE)
         if self.empty is True and has_value:
-            log_or_raise(
-                f'Card {k} is required to be empty but has value {card.value}',
-                WrongValue, log, onerror,
+            handle(
+                f'Card {self.keyword} is required to be empty'
+                f' but has value {value}',
+                WrongValue,
             )
+            return False
 
         if self.empty is False and not has_value:
-            log_or_raise(f'Card {k} exists but has no value', WrongValue, log, onerror)
-
-        return valid
+            handle(f'Card {self.keyword} exists but has no value', WrongValue)
+            return False
+        return True
 
 
 class HeaderSchemaMeta(type):
     def __new__(cls, name, bases, dct):
-        dct['__cards__'] = {}
         dct['__slots__'] = tuple()
+        new_cls = super().__new__(cls, name, bases, dct)
 
-        for base in reversed(bases):
-            if issubclass(base, HeaderSchema):
-                dct['__cards__'].update(base.__cards__)
+        if len(bases) == 1 and isinstance(bases[0], HeaderSchemaMeta):
+            # common case of single inheritance,
+            # the base already holds the merged cards of all its bases
+            cards = dict(bases[0].__cards__)
+        else:
+            # merge cards along the mro, so more derived classes take precedence
+            cards = {}
+            for base in reversed(new_cls.__mro__[1:]):
+                cards.update(vars(base).get('__cards__', {}))
 
         for k, v in dct.items():
             if isinstance(v, HeaderCard):
                 k = v.keyword or k  # use user override for keyword if there
-                dct['__cards__'][k] = v
+                cards[k] = v
 
-        new_cls = super().__new__(cls, name, bases, dct)
+        # read-only, so compiled schemas can rely on it not changing behind their back
+        new_cls.__cards__ = MappingProxyType(cards)
         return new_cls
 
 
+class _CompiledHeaderSchema(namedtuple(
+    '_CompiledHeaderSchema', ['required', 'cards', 'ignore_re']
+)):
+    '''
+    Immutable form of a `HeaderSchema`, holding everything needed for validation.
+
+    Created by `HeaderSchema.compile`.
+    '''
+    __slots__ = ()
+
+    def __new__(cls, required, cards, ignore_re):
+        return super().__new__(
+            cls, frozenset(required), MappingProxyType(dict(cards)), ignore_re,
+        )
+
+    def __reduce__(self):
+        # mapping proxies cannot be pickled, pass a plain dict instead
+        return self.__class__, (self.required, dict(self.cards), self.ignore_re)
+
+    def validate(self, header, onerror='raise'):
+        '''See `HeaderSchema.validate_header`'''
+        # resolve the error handling strategy once for all cards
+        handle = get_error_handler(onerror, log)
+
+        # the set of required keywords is small, probe the header for each
+        # instead of building a set of all header keywords
+        missing = {k for k in self.required if k not in header}
+
+        # first let's test for any missing required keys
+        if missing:
+            keywords = ', '.join(sorted(missing))
+            handle(
+                f'Header is missing the following required keywords: {keywords}',
+                RequiredMissing,
+            )
+
+        # no go through each of the header items and validate them with the schema
+        # bound methods as locals, this loop runs for every card of every header
+        get_schema = self.cards.get
+        ignore = self.ignore_re.match
+        for pos, card in enumerate(header.cards):
+            keyword = card.keyword
+            card_schema = get_schema(keyword)
+            if card_schema is None:
+                if not ignore(keyword):
+                    # formatting the card is expensive, only do it when needed
+                    handle(
+                        lambda card=card: f'Unexpected header card "{str(card).strip()}"',
+                        AdditionalHeaderCard,
+                    )
+                continue
+
+            card_schema.validate(card, pos, handle)
+
+        if onerror == 'collect':
+            return handle
+
+
 class HeaderSchema(metaclass=HeaderSchemaMeta):
     '''
     Schema definition for the header of a FITS HDU
@@ -230,32 +415,44 @@ class HeaderSchema(metaclass=HeaderSchemaMeta):
 
     @classmethod
     def validate_header(cls, header: fits.Header, onerror='raise'):
+        '''
+        Validate ``header`` against this schema.
 
-        required = {k for k, c in cls.__cards__.items() if c.required}
-        missing = required - set(header.keys())
+        ``onerror`` decides what happens with the problems found:
+        "raise" raises the first error, "log" logs all of them
+        and "collect" returns all of them as list of ``(exc_type, msg)`` tuples.
+        '''
+        return cls._compiled().validate(header, onerror)
 
-        # first let's test for any missing required keys
-        if missing:
-            log_or_raise(
-                f"Header is missing the following required keywords: {missing}",
-                RequiredMissing, log=log, onerror=onerror,
-            )
-
-        # no go through each of the header items and validate them with the schema
-        for pos, card in enumerate(header.cards):
-            kw = card.keyword
-            if kw not in cls.__cards__:
-                if kw.rstrip('0123456789') not in IGNORE:
-                    log_or_raise(
-                        f'Unexpected header card "{str(card).strip()}"',
-                        AdditionalHeaderCard,
-                        log=log,
-                        onerror=onerror
-                    )
-                continue
+    @classmethod
+    def compile(cls):
+        '''
+        Precompute everything needed for validation of headers with this schema.
+
+        Returns an immutable object with a ``validate(header, onerror)`` method.
+        It holds the required keywords at the time of compilation, compile again
+        after calling `update` or changing ``required`` of cards.
+        `validate_header` reuses it for all calls until one of these changes.
+        '''
+        cards = cls.__cards__
+        return _CompiledHeaderSchema(
+            required=(k for k, c in cards.items() if c.required),
+            cards=cards,
+            ignore_re=_IGNORE_RE,
+        )
 
-            cls.__cards__[card.keyword].validate(card, pos, onerror)
+    @classmethod
+    def _compiled(cls):
+        # look only at this class, not at the compiled schema of a base class
+        compiled = cls.__dict__.get('__compiled__')
+        if compiled is None or cls.__dict__['__compiled_at__'] != _required_changes:
+            compiled = cls.compile()
+            cls.__compiled__ = compiled
+            cls.__compiled_at__ = _required_changes
+        return compiled
 
     @classmethod
     def update(cls, other_schema):
-        cls.__cards__.update(other_schema.__cards__)
+        cls.__cards__ = MappingProxyType({**cls.__cards__, **other_schema.__cards__})
+        # rebuilt on next use
+        cls.__compiled__ = None
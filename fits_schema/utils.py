@@ -5,6 +5,83 @@ import warnings
 
 log = logging.getLogger(__name__)
 
+# error handlers by (onerror, log), see `get_error_handler`
+_HANDLERS = {}
+
+
+def get_error_handler(onerror='raise', log=log):
+    '''Get the error handler implementing the ``onerror`` strategy.
+
+    The handler is a callable ``handle(msg, exc_type)``.
+    ``msg`` can also be a function without arguments returning the message,
+    it is only called if the message is actually emitted.
+    With ``onerror='raise'``, it raises ``exc_type``, or issues it as warning
+    if it is a subclass of `UserWarning`.
+    With ``onerror='log'``, the message is logged as error or warning
+    using ``log``.
+    With ``onerror='collect'``, a new `ErrorCollector` is returned.
+    If ``onerror`` already is a handler, it is returned unchanged,
+    so functions can pass on their resolved handler.
+    '''
+    if callable(onerror):
+        return onerror
+
+    # this is called for every reported problem, so look up known handlers first
+    handler = _HANDLERS.get((onerror, log))
+    if handler is not None:
+        return handler
+
+    if onerror == 'collect':
+        return ErrorCollector()
+
+    if onerror not in ('raise', 'log'):
+        raise ValueError('`onerror` must be one of "raise", "log" or "collect"')
+
+    handler = _HANDLERS[onerror, log] = _make_error_handler(onerror, log)
+    return handler
+
+
+def _make_error_handler(onerror, log):
+    # handlers are created once per strategy and logger
+    if onerror == 'raise':
+        def handle(msg, exc_type=ValidationError):
+            if callable(msg):
+                msg = msg()
+
+            # raise if exception, warn if warning
+            if issubclass(exc_type, UserWarning):
+                warnings.warn(msg, exc_type)
+            else:
+                raise exc_type(msg)
+    else:
+        def handle(msg, exc_type=ValidationError):
+            if issubclass(exc_type, UserWarning):
+                level = logging.WARNING
+            else:
+                level = logging.ERROR
+
+            # don't build messages nobody will see
+            if not log.isEnabledFor(level):
+                return
+
+            if callable(msg):
+                msg = msg()
+            log.log(level, msg)
+
+    return handle
+
+
+class ErrorCollector(list):
+    '''
+    Error handler storing all problems as list of ``(exc_type, msg)`` tuples.
+
+    Useful to programmatically inspect all problems found in a validation.
+    '''
+    def __call__(self, msg, exc_type=ValidationError):
+        if callable(msg):
+            msg = msg()
+        self.append((exc_type, msg))
+
 
 def log_or_raise(msg, exc_type=ValidationError, log=log, onerror='raise'):
     '''Utility for error handling.
@@ -12,18 +89,4 @@ def log_or_raise(msg, exc_type=ValidationError, log=log, onerror='raise'):
     or as warning, depending on `exception_type`
     or if it is just logged.
     '''
-    # raise if exception, warn if warning
-    if onerror == 'raise':
-        if issubclass(exc_type, UserWarning):
-            warnings.warn(msg, exc_type)
-        else:
-            raise exc_type(msg)
-    # only log stuff
-    elif onerror == 'log':
-        if issubclass(exc_type, UserWarning):
-            log.warning(msg)
-        else:
-            log.error(msg)
-    # invalid arg to `onerror`
-    else:
-        raise ValueError('`onerror` must be either "raise" or "log"')
+    get_error_handler(onerror, log)(msg, exc_type)
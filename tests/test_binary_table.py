@@ -1,12 +1,23 @@
+import gc
+import pickle
 import astropy.units as u
-from astropy.table import Table
+from astropy.table import Table, Column
 from astropy.io import fits
 import pytest
 import numpy as np
 
 from fits_schema.exceptions import (
     WrongUnit, WrongType, RequiredMissing, WrongDims, WrongShape,
+    AdditionalHeaderCard,
 )
+from fits_schema.binary_table import BinaryTable, Double
+
+
+class PickleTable(BinaryTable):
+    '''Table defined on module level, so it can be pickled'''
+    energy = Double(unit=u.TeV)
+    flag = Double(name='FLAG-1', required=False)
+    unset = Double(required=False)
 
 
 def test_unit():
@@ -23,11 +34,30 @@ def test_unit():
     # convertible unit
     table = TestTable(test=[1, 2, 3] * u.cm)
     table.validate_data()
+    assert table.test.unit == u.m
+    assert u.allclose(table.test, [0.01, 0.02, 0.03] * u.m)
 
     table = TestTable(test=5 * u.deg)
     with pytest.raises(WrongUnit):
         table.validate_data()
 
+    # conversions respect the equivalencies enabled at the time of validation
+    column = Double(unit=u.Hz)
+    with u.set_enabled_equivalencies(u.spectral()):
+        column.validate_data([1.0] * u.m)
+    with pytest.raises(WrongUnit):
+        column.validate_data([1.0] * u.m)
+
+    # and those of quantities
+    from astropy.coordinates import SpectralQuantity
+    assert Double(unit=u.m).validate_data(SpectralQuantity([1.0], u.GHz)).unit == u.m
+
+    with pytest.raises(WrongUnit):
+        Double(unit=u.m).validate_data([1.0] * u.mag)
+
+    # units can be given as strings
+    assert Double(unit='m').unit is u.m
+
     # validate no unit is enforced:
     class TestTable(BinaryTable):
         test = Double(unit=u.dimensionless_unscaled)
@@ -62,6 +92,13 @@ def test_repr():
     TestTable.test.unit = u.m**-2
     assert repr(TestTable.test) == "Double(name='test', required=True, unit='m-2')"
 
+    # units without FITS representation can still be used
+    class TestTable(BinaryTable):
+        test = Double(unit=u.imperial.inch)
+
+    assert repr(TestTable.test) == "Double(name='test', required=True, unit='inch')"
+    TestTable.test.validate_data([1.0, 2.0])
+
 
 def test_access():
     from fits_schema.binary_table import BinaryTable, Double
@@ -84,6 +121,18 @@ def test_access():
     with pytest.raises(AttributeError):
         t.foo = 'bar'
 
+    # names that are not valid identifiers
+    class TestTable(BinaryTable):
+        test = Double(name='TEST-1', required=False)
+
+    t = TestTable()
+    assert t.test is None
+    t.test = [5.0]
+    assert t.test[0] == 5.0
+    t.validate_data()
+    del t.test
+    assert t.test is None
+
 
 def test_shape():
     from fits_schema.binary_table import BinaryTable, Double
@@ -188,6 +237,12 @@ def test_data_types():
     with pytest.raises(WrongType):
         table.validate_data()
 
+    # not convertible to an array at all
+    table.test = [1 * u.m, 2 * u.cm]
+    with pytest.raises(WrongType):
+        table.validate_data()
+    assert TestTable.test.validate_data(table.test, onerror='log') is None
+
 
 def test_inheritance():
     from fits_schema.binary_table import BinaryTable, Bool
@@ -288,3 +343,269 @@ def test_header():
     t.meta['TEST'] = 'hello'
     hdu = fits.BinTableHDU(t)
     TestTable.validate_hdu(hdu)
+
+
+def test_validation_cache():
+    from fits_schema.binary_table import BinaryTable, Double
+
+    class TestTable(BinaryTable):
+        test = Double(unit=u.m)
+
+    data = np.arange(10.0)
+    q = TestTable.test.validate_data(data)
+    assert TestTable.test.validate_data(q) is q
+    assert TestTable.test.validate_data(q) is q
+
+    # validating a table again only looks up the already validated columns
+    table = TestTable(test=[1.0, 2.0])
+    table.validate_data()
+    validated = table.test
+    TestTable.test._validator = None
+    table.validate_data()
+    assert table.test is validated
+    assert TestTable.test._validator is None
+
+    # converted data is not cached, changes to the input must be seen
+    data = np.arange(3, dtype=np.float32)
+    validated = TestTable.test.validate_data(data)
+    data[0] = 100
+    assert validated[0] == 0 * u.m
+    assert TestTable.test.validate_data(data)[0] == 100 * u.m
+
+    # changing the unit in place must not reuse the validation result
+    data = np.arange(3.0) * u.m
+    assert TestTable.test.validate_data(data) is data
+    data <<= u.cm
+    assert TestTable.test.validate_data(data).unit == u.m
+
+    TestTable.test.strict_unit = True
+    data = np.arange(3.0) * u.m
+    TestTable.test.validate_data(data)
+    data <<= u.cm
+    with pytest.raises(WrongUnit):
+        TestTable.test.validate_data(data)
+    TestTable.test.strict_unit = False
+
+    # only one entry per array, removed when the array is gone
+    column = Double(unit=u.m)
+    data = np.arange(3.0) * u.m
+    for _ in range(10):
+        column.validate_data(data)
+    assert len(column._validated_cache) == 1
+    del data
+    gc.collect()
+    assert len(column._validated_cache) == 0
+
+    # data with units that cannot be used as key is validated without cache
+    data = Column([1.0, 2.0], unit='foo')
+    for _ in range(2):
+        Double().validate_data(data)
+
+    # invalid data is not cached
+    data = np.arange(10.0) * u.deg
+    for _ in range(2):
+        with pytest.raises(WrongUnit):
+            TestTable.test.validate_data(data)
+
+
+def test_no_conversion():
+    from fits_schema.binary_table import BinaryTable, Double
+
+    class TestTable(BinaryTable):
+        test = Double(shape=(3, ))
+
+    data = np.zeros((5, 3))
+    assert TestTable.test.validate_data(data) is data
+
+    with pytest.raises(WrongShape):
+        TestTable.test.validate_data(np.zeros((5, 2)))
+
+    # columns without unit always result in plain arrays of the column dtype
+    class TestTable(BinaryTable):
+        test = Double()
+
+    for data in ([1, 2, 3], np.arange(3), 5):
+        validated = TestTable.test.validate_data(data)
+        assert type(validated) is np.ndarray
+        assert validated.dtype == np.float64
+        assert validated.ndim == 1
+
+    # units of the data are kept
+    table = TestTable(test=Column([1.0, 2.0], unit='cm'))
+    table.validate_data()
+    assert table.test.unit == u.cm
+
+    validated = TestTable.test.validate_data(Column([1.0, 2.0], unit='foo'))
+    assert validated.unit.name == 'foo'
+
+
+def test_validate_hdu_dtypes():
+    from fits_schema.binary_table import BinaryTable, Bool, Int16, Float
+
+    class TestTable(BinaryTable):
+        flag = Bool()
+        counts = Int16(unit=u.count)
+        pos = Float(shape=(2, ), unit=u.m)
+
+    t = Table({
+        'flag': [True, False],
+        'counts': u.Quantity([1, 2], u.count, dtype=np.int16),
+        'pos': np.zeros((2, 2), dtype=np.float32) * u.cm,
+    })
+    TestTable.validate_hdu(fits.BinTableHDU(t))
+
+    t['counts'] = [1.5, 2.5] * u.count
+    with pytest.raises(WrongType):
+        TestTable.validate_hdu(fits.BinTableHDU(t))
+
+
+def test_validate_hdu_no_unit():
+    from fits_schema.binary_table import BinaryTable, Double
+
+    class TestTable(BinaryTable):
+        energy = Double(unit=u.TeV)
+
+    # columns without TUNIT get the unit of the schema
+    hdu = fits.BinTableHDU.from_columns([fits.Column('energy', 'D', array=[1.0])])
+    assert hdu.columns.units == ['']
+    TestTable.validate_hdu(hdu)
+
+
+def test_no_copy():
+    from fits_schema.binary_table import BinaryTable, Double
+
+    class TestTable(BinaryTable):
+        test = Double(unit=u.m)
+
+    # matching dtype and unit, validation must not copy the data
+    data = np.arange(10.0) * u.m
+    assert np.shares_memory(TestTable.test.validate_data(data), data)
+    # a matching quantity is used as is
+    data = np.arange(10.0) * u.m
+    assert TestTable.test.validate_data(data) is data
+
+    # data is cast to the column dtype
+    data = np.arange(10, dtype=np.float32) * u.m
+    assert TestTable.test.validate_data(data).dtype == np.float64
+
+
+def test_change_settings():
+    from fits_schema.binary_table import BinaryTable, Double
+
+    class TestTable(BinaryTable):
+        test = Double(unit=u.m)
+
+    data = np.arange(10.0) * u.m
+    TestTable.test.validate_data(data)
+
+    # changing the column must not reuse previous validation results
+    TestTable.test.unit = u.s
+    with pytest.raises(WrongUnit):
+        TestTable.test.validate_data(data)
+
+    TestTable.test.unit = u.m
+    TestTable.test.shape = (2, )
+    TestTable.test.ndim = 1
+    with pytest.raises(WrongDims):
+        TestTable.test.validate_data(data)
+
+    # subclasses can set attributes before initializing the column
+    class MyColumn(Double):
+        def __init__(self, **kwargs):
+            self.foo = 'bar'
+            super().__init__(**kwargs)
+
+    assert MyColumn(unit=u.m).validate_data(data) is data
+
+
+def test_header_cache():
+    from fits_schema.binary_table import BinaryTable, Double
+    from fits_schema.header import HeaderSchema, HeaderCard
+
+    class TestTable(BinaryTable):
+        energy = Double(unit=u.TeV)
+
+        class __header__(HeaderSchema):
+            TEST = HeaderCard(type_=str)
+
+    t = Table({'energy': [1, 2, 3] * u.TeV})
+    t.meta['TEST'] = 'hello'
+    hdu = fits.BinTableHDU(t)
+    TestTable.validate_hdu(hdu)
+    TestTable.validate_hdu(hdu)
+
+    # modifying the header must invalidate the cache
+    hdu.header['TEST'] = 5
+    with pytest.raises(WrongType):
+        TestTable.validate_hdu(hdu)
+
+    # warnings of cached headers are issued again, other modes do not use the cache
+    hdu.header['TEST'] = 'hello'
+    hdu.header['FOO'] = 'bar'
+    for _ in range(2):
+        with pytest.warns(AdditionalHeaderCard):
+            TestTable.validate_hdu(hdu)
+    errors = TestTable.validate_hdu(hdu, onerror='collect')
+    assert [e[0] for e in errors] == [AdditionalHeaderCard]
+
+    # updating the header schema must invalidate the cache
+    class Other(HeaderSchema):
+        FOO = HeaderCard(type_=int)
+        BAR = HeaderCard(required=False)
+
+    TestTable.__header__.update(Other)
+    with pytest.raises(WrongType):
+        TestTable.validate_hdu(hdu)
+
+    # as must changing if a card is required
+    hdu.header['FOO'] = 1
+    TestTable.validate_hdu(hdu)
+    Other.BAR.required = True
+    with pytest.raises(RequiredMissing):
+        TestTable.validate_hdu(hdu)
+
+
+def test_collect():
+    from fits_schema.binary_table import BinaryTable, Double, Int16
+
+    class TestTable(BinaryTable):
+        energy = Double(unit=u.TeV)
+        counts = Int16()
+        ra = Double(unit=u.deg)
+
+    t = Table({
+        'energy': [1, 2, 3] * u.m,
+        'counts': [1.5, 2.5, 3.5],
+    })
+    errors = TestTable.validate_hdu(fits.BinTableHDU(t), onerror='collect')
+    assert {e[0] for e in errors} == {RequiredMissing, WrongUnit, WrongType}
+
+    # data that cannot be converted is reported, not raised
+    t = Table({
+        'energy': ['a', 'b', 'c'],
+        'counts': np.arange(3, dtype=np.int16),
+        'ra': [1.0, 2.0, 3.0] * u.deg,
+    })
+    errors = TestTable.validate_hdu(fits.BinTableHDU(t), onerror='collect')
+    assert [e[0] for e in errors] == [WrongType]
+
+
+def test_pickle():
+    t = PickleTable(energy=[1.0, 2.0] * u.TeV)
+    setattr(t.__data__, 'FLAG-1', np.zeros(2))
+    t.header['FOO'] = 'bar'
+
+    loaded = pickle.loads(pickle.dumps(t))
+    assert type(loaded) is PickleTable
+    assert (loaded.energy == t.energy).all()
+    assert (getattr(loaded.__data__, 'FLAG-1') == 0).all()
+    assert loaded.unset is None
+    assert loaded.header['FOO'] == 'bar'
+    loaded.validate_data()
+
+    # columns can be pickled also after they were used for validation
+    column = pickle.loads(pickle.dumps(PickleTable.energy))
+    assert column.unit == u.TeV
+    assert column.name == 'energy'
+    assert column.validate_data([1.0]).unit == u.TeV
+    assert pickle.loads(pickle.dumps(column)).validate_data([1.0]).unit == u.TeV
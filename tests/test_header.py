@@ -181,3 +181,101 @@ def test_case():
     h['TEST'] = 'Foo'
     with pytest.raises(WrongValue):
         Header.validate_header(h)
+
+
+def test_type_normalization():
+    from fits_schema.header import HeaderCard
+
+    assert HeaderCard(type_=[str]).type is str
+    assert HeaderCard(allowed_values='foo').type is str
+    assert HeaderCard(type_=[int, bool]).type == (bool, int)
+    # allowed values are checked against all given types
+    HeaderCard(type_=[str, int], allowed_values=['foo', 1])
+
+
+def test_collect():
+    from fits_schema.primary import PrimaryHeader
+    from fits_schema.exceptions import AdditionalHeaderCard
+
+    h = fits.Header()
+    h['SIMPLE'] = False
+    h['BITPIX'] = 16
+    h['FOO'] = 'bar'
+
+    errors = PrimaryHeader.validate_header(h, onerror='collect')
+    assert [e[0] for e in errors] == [RequiredMissing, WrongValue, AdditionalHeaderCard]
+
+    h['SIMPLE'] = True
+    h['NAXIS'] = 0
+    del h['FOO']
+    assert PrimaryHeader.validate_header(h, onerror='collect') == []
+
+    # single cards need an explicit collector
+    with pytest.raises(ValueError):
+        PrimaryHeader.SIMPLE.validate(h.cards['SIMPLE'], 0, onerror='collect')
+
+
+def test_compile():
+    import pickle
+    from fits_schema.primary import PrimaryHeader
+    from fits_schema.header import HeaderSchema, HeaderCard
+
+    compiled = PrimaryHeader.compile()
+    assert compiled.required == {'SIMPLE', 'BITPIX', 'NAXIS'}
+    with pytest.raises(TypeError):
+        compiled.cards['FOO'] = HeaderCard()
+
+    compiled = pickle.loads(pickle.dumps(compiled))
+    hdu = fits.PrimaryHDU()
+    compiled.validate(hdu.header)
+
+    # updating a schema must update the validation
+    class Header(HeaderSchema):
+        TEST = HeaderCard()
+
+    h = fits.Header()
+    h['TEST'] = 1
+    Header.validate_header(h)
+
+    class Other(HeaderSchema):
+        FOO = HeaderCard()
+
+    Header.update(Other)
+    with pytest.raises(RequiredMissing):
+        Header.validate_header(h)
+
+    # cards can only be changed through update
+    with pytest.raises(TypeError):
+        Header.__cards__['BAR'] = HeaderCard()
+    assert 'FOO' in Header.__cards__
+
+
+def test_change_settings():
+    from fits_schema.header import HeaderSchema, HeaderCard
+
+    class Header(HeaderSchema):
+        TEST = HeaderCard(allowed_values='X')
+
+    h = fits.Header()
+    h['TEST'] = 'y'
+    with pytest.raises(WrongValue):
+        Header.validate_header(h)
+
+    # changing a card must change its validation
+    Header.TEST.allowed_values = {'Y'}
+    Header.validate_header(h)
+
+    Header.TEST.type = int
+    with pytest.raises(WrongType):
+        Header.validate_header(h)
+
+    Header.TEST.type = None
+    Header.validate_header(h)
+
+    # changing required must be respected by already compiled schemas
+    h = fits.Header()
+    Header.TEST.required = True
+    with pytest.raises(RequiredMissing):
+        Header.validate_header(h)
+    Header.TEST.required = False
+    Header.validate_header(h)
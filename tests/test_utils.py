@@ -27,3 +27,54 @@ def test_log_or_raise(caplog):
 
     with pytest.raises(ValueError):
         log_or_raise('Foo', TypeError, log=log, onerror='invalid')
+
+
+def test_get_error_handler(caplog):
+    from fits_schema.utils import get_error_handler
+
+    log = logging.getLogger('test_get_error_handler')
+
+    handle = get_error_handler('raise', log=log)
+    assert get_error_handler('raise', log=log) is handle
+    assert get_error_handler(handle) is handle
+
+    with pytest.raises(ValueError):
+        handle('Foo', ValueError)
+
+    with pytest.warns(AdditionalHeaderCard):
+        handle('Foo', AdditionalHeaderCard)
+
+    caplog.clear()
+    get_error_handler('log', log=log)('Foo', ValueError)
+    assert caplog.record_tuples[0] == ('test_get_error_handler', logging.ERROR, 'Foo')
+
+    with pytest.raises(ValueError):
+        get_error_handler('invalid')
+
+
+def test_lazy_message(caplog):
+    from fits_schema.utils import get_error_handler
+
+    log = logging.getLogger('test_lazy_message')
+
+    def msg():
+        msg.calls += 1
+        return 'Foo'
+    msg.calls = 0
+
+    with pytest.raises(ValueError, match='Foo'):
+        get_error_handler('raise', log=log)(msg, ValueError)
+    assert msg.calls == 1
+
+    caplog.clear()
+    get_error_handler('log', log=log)(msg, ValueError)
+    assert caplog.record_tuples[0] == ('test_lazy_message', logging.ERROR, 'Foo')
+    assert msg.calls == 2
+
+    # message is not built if it would not be logged
+    log.disabled = True
+    try:
+        get_error_handler('log', log=log)(msg, ValueError)
+    finally:
+        log.disabled = False
+    assert msg.calls == 2